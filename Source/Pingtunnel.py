@@ -1,16 +1,23 @@
 #!/usr/bin/env python3
-import os, sys, json, time, platform, tempfile, zipfile, urllib.request, shutil, subprocess, signal 
+import os, sys, json, time, random, string, py_compile, shutil, subprocess, signal, functools, concurrent.futures
 from pathlib import Path
+from collections import deque
 INSTALL_DIR = Path("/opt/pingtunnel")
 BIN_DIR = INSTALL_DIR / "bin"
 CONF_DIR = INSTALL_DIR / "conf"
 LOG_DIR = Path("/var/log/pingtunnel")
 RUNNER_PATH = INSTALL_DIR / "run_pingtunnel.py"
+RUNNER_PYC = INSTALL_DIR / "run_pingtunnel.pyc"
 CONFIG_PATH = CONF_DIR / "config.json"
+ENV_PATH = CONF_DIR / "pingtunnel.env"
+STATE_PATH = CONF_DIR / "state.json"
 SYMLINK = Path("/usr/local/bin/pingtunnel")
 SYSTEMD_UNIT = "pingtunnel.service"
 UNIT_PATH = Path("/etc/systemd/system") / SYSTEMD_UNIT
 PID_FILE = Path("/run/pingtunnel.pid")
+PARALLEL_MAX = 8 * 1024 * 1024
+COPY_BUF = 1024 * 1024
+_HAS_SYSTEMCTL = shutil.which("systemctl") is not None
 
 URLS = {
     "x86_64": "https://github.com/esrrhs/pingtunnel/releases/download/2.8/pingtunnel_linux_amd64.zip",
@@ -21,6 +28,9 @@ URLS = {
     "i386":   "https://github.com/esrrhs/pingtunnel/releases/download/2.8/pingtunnel_linux_386.zip",
     "i686":   "https://github.com/esrrhs/pingtunnel/releases/download/2.8/pingtunnel_linux_386.zip",
 }
+# resolved once at import; the machine type can't change under us
+_ARCH = os.uname().machine.lower()
+_URL = URLS.get(_ARCH) or (URLS.get("arm64") if "arm" in _ARCH else URLS.get("x86_64"))
 
 def clear():
     os.system('cls' if os.name == 'nt' else 'clear')
@@ -33,83 +43,406 @@ def die(msg="error"):
     sys.exit(1)
 
 def detect_download_url():
-    m = platform.machine().lower()
-    if m in URLS:
-        return URLS[m]
-    if "arm" in m:
-        return URLS.get("arm64")
-    return URLS.get("x86_64")
+    return _URL
+
+def run(cmd, check=False, capture=False):
+    # output is only collected when the caller reads it; otherwise discarded
+    if capture:
+        return subprocess.run(cmd, check=check, capture_output=True, text=True)
+    return subprocess.run(cmd, check=check, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+# systemd reloads are coalesced: helpers only mark one as needed and the
+# install/uninstall flows run it once at the end
+_reload_pending = False
+
+def schedule_reload():
+    global _reload_pending
+    _reload_pending = True
+
+def _needs_reload():
+    # systemd only tracks staleness for a loaded unit; a new or unknown one
+    # still gets the reload so its file is picked up
+    r = run(["systemctl", "show", "-p", "LoadState", "-p", "NeedDaemonReload", SYSTEMD_UNIT], capture=True)
+    return r.returncode != 0 or "LoadState=loaded" not in r.stdout or "NeedDaemonReload=no" not in r.stdout
+
+def flush_reload():
+    global _reload_pending
+    if _reload_pending:
+        if _needs_reload():
+            run(["systemctl", "daemon-reload"])
+        _reload_pending = False
+
+def _atomic_write(path, data, mode=0o600):
+    # write next to the target and rename over it, so a crash never
+    # leaves a half-written unit/config/runner behind
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data.encode())
+        f.flush()
+        os.fsync(f.fileno())
+    os.chmod(tmp, mode)
+    os.replace(tmp, path)
+
+def _write_if_changed(path, data, mode=0o644):
+    # identical content: leave the file (and systemd) alone
+    try:
+        if path.read_text() == data:
+            return False
+    except OSError:
+        pass
+    _atomic_write(path, data, mode)
+    return True
+
+def _ensure(p):
+    # stat first: on reinstall/update every dir already exists
+    try:
+        os.stat(p)
+    except FileNotFoundError:
+        p.mkdir(parents=True, exist_ok=True)
 
 def ensure_dirs():
-    BIN_DIR.mkdir(parents=True, exist_ok=True)
-    CONF_DIR.mkdir(parents=True, exist_ok=True)
-    LOG_DIR.mkdir(parents=True, exist_ok=True)
-    INSTALL_DIR.mkdir(parents=True, exist_ok=True)
-
-def download_file(url, dest, tries=4):
-    last = None
-    for i in range(1, tries+1):
-        try:
-            req = urllib.request.Request(url, headers={"User-Agent":"curl/7.68.0"})
-            with urllib.request.urlopen(req, timeout=30) as r, open(dest, "wb") as f:
-                while True:
-                    chunk = r.read(8192)
-                    if not chunk:
-                        break
-                    f.write(chunk)
-            return
-        except Exception as e:
-            last = e
-            time.sleep(1 + i)
-    raise last
-
-def safe_extract(zip_path, target_dir):
-    with zipfile.ZipFile(zip_path, "r") as z:
-        for member in z.namelist():
-            resolved = (target_dir / member).resolve()
-            if not str(resolved).startswith(str(target_dir.resolve())):
-                raise Exception("zip contains unsafe path: " + member)
-        z.extractall(target_dir)
+    _ensure(BIN_DIR)
+    _ensure(CONF_DIR)
+    _ensure(LOG_DIR)
+    _ensure(INSTALL_DIR)
 
-def find_pingtunnel_binary():
-    for p in BIN_DIR.rglob("*"):
-        if p.is_file() and "pingtunnel" in p.name.lower():
+# one keep-alive connection per (scheme, host), shared by redirects and retries
+_CONNS = {}
+# the connection of the request in flight, for _drop_active()
+_ACTIVE = [None]
+
+def _http_get(url, headers, redirects=5, method="GET"):
+    import http.client, urllib.parse, urllib.error
+    for _ in range(redirects + 1):
+        u = urllib.parse.urlsplit(url)
+        conn = _CONNS.get((u.scheme, u.netloc))
+        if conn is None:
+            cls = http.client.HTTPSConnection if u.scheme == "https" else http.client.HTTPConnection
+            conn = _CONNS[(u.scheme, u.netloc)] = cls(u.netloc, timeout=30)
+        _ACTIVE[0] = conn
+        conn.request(method, u.path + ("?" + u.query if u.query else ""), headers=headers)
+        r = conn.getresponse()
+        if r.status in (301, 302, 303, 307, 308):
+            r.read()
+            url = urllib.parse.urljoin(url, r.getheader("Location"))
+            continue
+        if r.status >= 400:
+            r.read()
+            raise urllib.error.HTTPError(url, r.status, r.reason, r.headers, None)
+        # like urllib: the URL the response finally came from
+        r.url = url
+        return r
+    raise urllib.error.URLError("too many redirects: " + url)
+
+def _drop_active():
+    # only the connection that failed mid-request is unusable; the others
+    # (e.g. github.com before the redirect) stay warm for the retry.
+    # http.client reconnects a closed connection on its next request
+    if _ACTIVE[0] is not None:
+        _ACTIVE[0].close()
+
+def _fetch_range(url, start, view):
+    import http.client, urllib.parse
+    # one connection per part; the shared _CONNS pool isn't thread-safe
+    u = urllib.parse.urlsplit(url)
+    cls = http.client.HTTPSConnection if u.scheme == "https" else http.client.HTTPConnection
+    conn = cls(u.netloc, timeout=30)
+    try:
+        conn.request("GET", u.path + ("?" + u.query if u.query else ""),
+                     headers={"User-Agent":"curl/7.68.0", "Range": "bytes=%d-%d" % (start, start + len(view) - 1)})
+        r = conn.getresponse()
+        if r.status != 206 or r.length != len(view):
+            raise http.client.HTTPException("range request answered with %d" % r.status)
+        got = 0
+        while got < len(view):
+            n = r.readinto(view[got:])
+            if not n:
+                raise http.client.IncompleteRead(b"", len(view) - got)
+            got += n
+    finally:
+        conn.close()
+
+def _parallel_download(url, etag=None, parts=4):
+    # fetch the zip as `parts` concurrent byte ranges into memory. returns
+    # (data, etag) like download_file, or None when the server doesn't
+    # advertise ranges / a length, the file is small or over PARALLEL_MAX, or
+    # any part fails; download_file then streams it on one connection
+    import io, http.client
+    headers = {"User-Agent":"curl/7.68.0"}
+    if etag:
+        headers["If-None-Match"] = etag
+    try:
+        with _http_get(url, headers, method="HEAD") as r:
+            if r.status == 304:
+                return None, etag
+            size = int(r.getheader("Content-Length") or 0)
+            ranged = (r.getheader("Accept-Ranges") or "").lower() == "bytes"
+            new_etag, final = r.getheader("ETag"), r.url
+    except (OSError, ValueError, http.client.HTTPException):
+        return None
+    n = min(parts, size // COPY_BUF)
+    if not ranged or n < 2 or size > PARALLEL_MAX:
+        return None
+    buf = bytearray(size)
+    view = memoryview(buf)
+    step = -(-size // n)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n) as pool:
+            list(pool.map(lambda a: _fetch_range(final, a, view[a:a + step]), range(0, size, step)))
+    except (OSError, http.client.HTTPException):
+        return None
+    return io.BytesIO(buf), new_etag
+
+def download_file(url, tries=4, etag=None):
+    # the zip is streamed into an unnamed temp file under
+    # INSTALL_DIR (the same filesystem as BIN_DIR rather than /tmp) which is
+    # returned rewound. a real file, not SpooledTemporaryFile: before 3.11
+    # that lacks .seekable, which zipfile needs to open members
+    # returns (data, etag); data is None when the server answers 304 to etag
+    # network/zip modules are imported here, not at the top, so the
+    # start/stop/status pass-through doesn't pay for them
+    import tempfile, http.client, urllib.error
+    got = _parallel_download(url, etag)
+    if got is not None:
+        return got
+    out = tempfile.TemporaryFile(suffix=".zip", dir=INSTALL_DIR)
+    try:
+        last = None
+        for i in range(1, tries+1):
+            # resume from whatever the previous attempt already wrote
+            have = out.seek(0, os.SEEK_END)
+            headers = {"User-Agent":"curl/7.68.0"}
+            if have:
+                headers["Range"] = f"bytes={have}-"
+            if etag:
+                headers["If-None-Match"] = etag
             try:
-                p.chmod(p.stat().st_mode | 0o111)
-            except:
+                with _http_get(url, headers) as r:
+                    if r.status == 304:
+                        r.read()
+                        out.close()
+                        return None, etag
+                    new_etag = r.getheader("ETag")
+                    # 206 continues the partial data, a plain 200 starts over
+                    if r.status != 206:
+                        out.seek(0)
+                        out.truncate()
+                    shutil.copyfileobj(r, out, length=COPY_BUF)
+                    # short reads don't raise on their own; a dropped connection
+                    # shows up as bytes still owed against Content-Length
+                    if r.length:
+                        raise http.client.IncompleteRead(b"", r.length)
+                out.seek(0)
+                return out, new_etag
+            except urllib.error.HTTPError as e:
+                last = e
+                if e.code == 416:
+                    # range no longer valid; drop the partial data and refetch
+                    out.seek(0)
+                    out.truncate()
+                elif 400 <= e.code < 500:
+                    raise
+            except (OSError, http.client.HTTPException) as e:
+                # IncompleteRead / socket timeouts keep the bytes written so far
+                last = e
+                _drop_active()
+            if i < tries:
+                # capped exponential backoff with full jitter
+                time.sleep(random.uniform(0, min(30, 0.5 * (2 ** i))))
+        raise last
+    except BaseException:
+        out.close()
+        raise
+
+def _extract_member(z, zi, dest, mtime):
+    # 1 MiB copies instead of extract()'s small default buffer
+    with z.open(zi) as src, open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst, length=COPY_BUF)
+        os.fsync(dst.fileno())
+    # stamp the archive's mtime so the next install can recognise it
+    os.utime(dest, (mtime, mtime))
+
+def safe_extract(zip_src, target_dir):
+    import zipfile
+    # only the pingtunnel binary is extracted (README/LICENSE are skipped);
+    # returns its path, or None if the archive has no such member.
+    # members go to a sibling <target>.new that is then renamed over
+    # target_dir, so an interrupted extract never leaves a half-written
+    # binary behind (and a running one is never written into)
+    root = str(target_dir.resolve())
+    new_root = root + ".new"
+    members, changed = [], False
+    with zipfile.ZipFile(zip_src, "r") as z:
+        for zi in z.infolist():
+            # nothing is extracted yet, so a lexical check against the
+            # resolved root is enough; no per-member realpath
+            full = os.path.normpath(os.path.join(root, zi.filename))
+            if not full.startswith(root + os.sep):
+                raise Exception("zip contains unsafe path: " + zi.filename)
+            if zi.is_dir() or "pingtunnel" not in os.path.basename(zi.filename).lower() or zi.file_size <= 10000:
+                continue
+            rel = full[len(root):]
+            mtime = time.mktime(zi.date_time + (0, 0, -1))
+            members.append((zi, new_root + rel, mtime))
+            try:
+                st = os.stat(full)
+                # same size and timestamp as the member: already extracted
+                if st.st_size == zi.file_size and int(st.st_mtime) == int(mtime):
+                    continue
+            except OSError:
                 pass
-            return p
+            changed = True
+        if changed:
+            shutil.rmtree(new_root, ignore_errors=True)
+            for _, dest, _ in members:
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if len(members) > 1:
+                # ZipFile serializes the raw reads on its own lock; inflating
+                # (zlib, GIL released) runs in parallel across members
+                with concurrent.futures.ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1)) as pool:
+                    list(pool.map(lambda m: _extract_member(z, *m), members))
+            else:
+                _extract_member(z, *members[0])
+            # a directory can't be renamed over a non-empty one, so the old
+            # tree steps aside first
+            old_root = root + ".old"
+            shutil.rmtree(old_root, ignore_errors=True)
+            try:
+                os.replace(root, old_root)
+            except FileNotFoundError:
+                pass
+            os.replace(new_root, root)
+            shutil.rmtree(old_root, ignore_errors=True)
+    return Path(root + members[0][1][len(new_root):]) if members else None
+
+def _sha256(path):
+    import hashlib
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(COPY_BUF), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _installed_release(url):
+    # state of the release we last extracted (url, etag, sha256, binary);
+    # only trusted for the same URL and while the binary still hashes to
+    # what we installed, so a wiped or damaged bin/ always downloads again
+    try:
+        st = json.loads(STATE_PATH.read_text())
+        if st.get("url") == url and _sha256(st["binary"]) == st.get("sha256"):
+            return st
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def find_pingtunnel_binary():
+    pending = deque([str(BIN_DIR)])
+    while pending:
+        try:
+            it = os.scandir(pending.popleft())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                # the size floor skips stray text files that merely share the name
+                if ("pingtunnel" in entry.name.lower() and entry.is_file(follow_symlinks=False)
+                        and entry.stat(follow_symlinks=False).st_size > 10000):
+                    p = Path(entry.path)
+                    try:
+                        p.chmod(entry.stat().st_mode | 0o111)
+                    except:
+                        pass
+                    return p
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
     return None
 
 # Runner template
 RUNNER_TEMPLATE = r'''#!/usr/bin/env python3
-import os, sys, json, time, subprocess, shutil, signal, tempfile, zipfile, urllib.request
+import os, sys, json, time, atexit, functools, subprocess, shutil, signal, select
 from pathlib import Path
-from colorama import Fore, Style, init
-init(autoreset=True)
-INSTALL_DIR = Path("__INSTALL_DIR__")
+from collections import deque
+try:
+    # optional, faster parser; both accept the raw bytes of config.json
+    from orjson import loads as _loads
+except ImportError:
+    _loads = json.loads
+INSTALL_DIR = Path("$install_dir")
 BIN_DIR = INSTALL_DIR / "bin"
 CONF = INSTALL_DIR / "conf" / "config.json"
-LOG_DIR = Path("__LOG_DIR__")
+ENV_FILE = INSTALL_DIR / "conf" / "pingtunnel.env"
+RUNNER_PYC = INSTALL_DIR / "run_pingtunnel.pyc"
+LOG_DIR = Path("$log_dir")
 LOG_FILE = LOG_DIR / "pingtunnel.log"
-UNIT = "__UNIT__"
+UNIT = "$unit"
 PID_FILE = Path("/run/pingtunnel.pid")
-URLS = __URLS_JSON__
+URLS = $urls_json
+_HAS_SYSTEMCTL = shutil.which("systemctl") is not None
+
+_LOG_FH = None
+
+_NOW_CACHE = [0, ""]
+
+def now():
+    # log lines mostly arrive in bursts; format each second only once
+    t = int(time.time())
+    if t != _NOW_CACHE[0]:
+        _NOW_CACHE[0] = t
+        _NOW_CACHE[1] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
+    return _NOW_CACHE[1]
+
+def _get_log_fh():
+    # one line-buffered handle for the whole process instead of open/close
+    # per line; False once opening failed (e.g. non-root), so we stop retrying
+    global _LOG_FH
+    if _LOG_FH is None:
+        try:
+            LOG_DIR.mkdir(parents=True, exist_ok=True)
+            _LOG_FH = open(LOG_FILE, "a", buffering=1)
+            atexit.register(_LOG_FH.close)
+        except PermissionError:
+            _LOG_FH = False
+    return _LOG_FH
 
-def now(): return time.strftime("%Y-%m-%d %H:%M:%S")
 def log(s):
+    line = f"{now()} {s}"
     try:
-        LOG_DIR.mkdir(parents=True, exist_ok=True)
-        with open(LOG_FILE, "a") as f:
-            f.write(f"{now()} {s}\n")
+        fh = _get_log_fh()
+        if fh:
+            fh.write(line + "\n")
     except:
         pass
-    print(f"{now()} {s}")
+    print(line)
+
+# pid of the pingtunnel child monitor_loop is waiting on, if any
+_CHILD = [None]
+
+def _on_sigterm(signum, frame):
+    # take the tunnel down with the monitor, then exit normally so atexit
+    # flushes and closes the log handle
+    if _CHILD[0]:
+        try:
+            os.kill(_CHILD[0], signal.SIGTERM)
+        except OSError:
+            pass
+    sys.exit(0)
+
+_CONF_CACHE = {"mtime": 0, "data": None}
 
 def load_conf():
-    if not CONF.exists():
+    # parsed once per process; re-read only if config.json changed on disk
+    try:
+        mtime = CONF.stat().st_mtime_ns
+    except FileNotFoundError:
         raise SystemExit("config missing: " + str(CONF))
-    return json.load(open(CONF))
+    if _CONF_CACHE["data"] is None or _CONF_CACHE["mtime"] != mtime:
+        data = _loads(CONF.read_bytes())
+        # optional free-form flags, tokenized once per load
+        data["_extra_tokens"] = tuple(str(data.get("extra_args", "")).split())
+        data["_extra_flags"] = frozenset(t for t in data["_extra_tokens"] if t.startswith("-"))
+        _CONF_CACHE["data"] = data
+        _CONF_CACHE["mtime"] = mtime
+    return _CONF_CACHE["data"]
 
 def find_bin(conf):
     b = conf.get("binary")
@@ -117,80 +450,151 @@ def find_bin(conf):
         p = Path(b)
         if p.exists():
             return p
-    for x in BIN_DIR.rglob("*"):
-        if x.is_file() and "pingtunnel" in x.name.lower():
-            try:
-                x.chmod(x.stat().st_mode | 0o111)
-            except:
-                pass
-            return x
+    pending = deque([str(BIN_DIR)])
+    while pending:
+        try:
+            it = os.scandir(pending.popleft())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                # the size floor skips stray text files that merely share the name
+                if ("pingtunnel" in entry.name.lower() and entry.is_file(follow_symlinks=False)
+                        and entry.stat(follow_symlinks=False).st_size > 10000):
+                    x = Path(entry.path)
+                    try:
+                        x.chmod(entry.stat().st_mode | 0o111)
+                    except:
+                        pass
+                    # remembered on the cached conf (dropped with it when
+                    # config.json changes), so the walk and chmod run once
+                    conf["binary"] = entry.path
+                    return x
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
     raise SystemExit("pingtunnel binary not found in " + str(BIN_DIR))
 
+_SERVER_ARGS = ("-type", "server")
+_CLIENT_ARGS = ("-type", "client")
+_QUIET_ARGS = (("-noprint", "1"), ("-nolog", "1"))
+
 def build_args(conf, binpath):
-    args = [str(binpath)]
-    t = conf.get("type", "server").lower()
-    key = conf.get("key", "")
+    key = str(conf.get("key", ""))
     tcp = conf.get("tcp", 1)
-    
-    if t == "server":
-        args += ["-type", "server", "-key", key, "-noprint", "1", "-nolog", "1"]
+    # a quiet default the user set in extra_args (e.g. -nolog 0) is left out
+    flags = conf.get("_extra_flags", frozenset())
+    quiet = [x for pair in _QUIET_ARGS if pair[0] not in flags for x in pair]
+    if conf.get("type", "server").lower() == "server":
+        args = [str(binpath), *_SERVER_ARGS, "-key", key, *quiet]
         if tcp == 1:
             args += ["-tcp", "1"]
-        else:
-            args += []
     else:
         lport = conf.get("l_port")
-        if lport:
-            args += ["-type", "client", "-l", ":" + str(lport)]
-        else:
-            args += ["-type", "client"]
         server = conf.get("server")
+        args = [str(binpath), *_CLIENT_ARGS]
+        if lport:
+            args += ["-l", ":" + str(lport)]
         if server:
             args += ["-s", str(server), "-t", str(server) + ":" + str(lport)]
-        args += ["-key", key, "-noprint", "1", "-nolog", "1"]
-        if tcp == 1:
-            args += ["-tcp", "1"]
-        else:
-            args += ["-tcp", "0"]
-    return args
+        args += ["-key", key, *quiet, "-tcp", "1" if tcp == 1 else "0"]
+    return args + list(conf.get("_extra_tokens", ()))
+
+def write_env(conf):
+    # under systemd the unit execs the binary itself with these variables.
+    # unbraced ARGS is split on whitespace, so the key travels separately
+    # and the unit passes it braced (-key $${KEY}), which stays one argument
+    args = build_args(conf, "")[1:]
+    i = args.index("-key")
+    key = args[i + 1].replace("\\", "\\\\").replace('"', '\\"')
+    del args[i:i + 2]
+    # it holds the key and the unit requires it: created 0600 (never readable
+    # by others, even briefly), fsynced, then renamed over the old one
+    tmp = ENV_FILE.with_suffix(".tmp")
+    with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        os.fchmod(f.fileno(), 0o600)
+        f.write('KEY="%s"\nARGS="%s"\n' % (key, " ".join(args)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, ENV_FILE)
+
+def sync_systemd():
+    # refresh the env file the unit reads before systemd (re)starts the
+    # binary; the memory drop-in is left to the installer and 'apply-mem'.
+    # a caller that can't write it (non-root) still gets the systemctl
+    # hand-off, with the env file from the last install or root start
+    try:
+        write_env(load_conf())
+    except OSError as e:
+        log("env file not refreshed: " + str(e))
+
+def _needs_reload():
+    # same check as the installer: skip only for a loaded, up-to-date unit
+    r = subprocess.run(["systemctl","show","-p","LoadState","-p","NeedDaemonReload",UNIT], capture_output=True, text=True)
+    return r.returncode != 0 or "LoadState=loaded" not in r.stdout or "NeedDaemonReload=no" not in r.stdout
 
 def apply_systemd_mem(conf):
+    # a drop-in means nothing when the monitor wasn't started by systemd
+    if not is_systemd_available():
+        return
     m = int(conf.get("memory_mb", 0) or 0)
     dropin = Path("/etc/systemd/system") / (UNIT + ".d")
     memfile = dropin / "memory.conf"
     if m > 0:
+        new = "[Service]\nMemoryMax=%dM\nMemoryHigh=%dM\n" % (m, int(m * 0.9))
+        # unchanged drop-in: skip the write and the daemon-reload
+        if memfile.exists() and memfile.read_text() == new:
+            return
         dropin.mkdir(parents=True, exist_ok=True)
-        memfile.write_text("[Service]\nMemoryLimit=%dM\n" % m)
-        subprocess.run(["systemctl","daemon-reload"])
+        tmp = memfile.with_suffix(".tmp")
+        tmp.write_text(new)
+        os.replace(tmp, memfile)
+        if _needs_reload():
+            subprocess.run(["systemctl","daemon-reload"])
     else:
-        if memfile.exists():
-            try:
-                memfile.unlink()
-                subprocess.run(["systemctl","daemon-reload"])
-            except:
-                pass
+        try:
+            memfile.unlink()
+        except OSError:
+            return
+        if _needs_reload():
+            subprocess.run(["systemctl","daemon-reload"])
 
 def monitor_loop():
     print("🔄 Running monitor loop... (Press Ctrl+C to exit)")
+    signal.signal(signal.SIGTERM, _on_sigterm)
     conf = load_conf()
     binpath = find_bin(conf)
-    apply_systemd_mem(conf)
     args = build_args(conf, binpath)
+    args_str = " ".join(args)
     log("monitor loop starting")
+    delay = 1
     while True:
-        log("starting: " + " ".join(args))
+        log("starting: " + args_str)
+        t0 = time.monotonic()
         try:
-            with open(LOG_FILE, "ab") as out:
-                p = subprocess.Popen(args, stdout=out, stderr=out)
-            log("child pid=%d" % p.pid)
-            rc = p.wait()
-            if rc < 0:
-                log("child killed by signal %d" % (-rc))
+            # posix_spawn skips fork's page-table copy on every respawn
+            fd = os.open(LOG_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                pid = os.posix_spawn(args[0], args, os.environ,
+                                     file_actions=[(os.POSIX_SPAWN_DUP2, fd, 1), (os.POSIX_SPAWN_DUP2, fd, 2)])
+            finally:
+                os.close(fd)
+            _CHILD[0] = pid
+            log("child pid=%d" % pid)
+            # decoded by hand: os.waitstatus_to_exitcode needs Python 3.9
+            st = os.waitpid(pid, 0)[1]
+            _CHILD[0] = None
+            if os.WIFSIGNALED(st):
+                log("child killed by signal %d" % os.WTERMSIG(st))
             else:
-                log("child exited %d" % rc)
+                log("child exited %d" % os.WEXITSTATUS(st))
         except Exception as e:
             log("launch error: " + str(e))
-        time.sleep(3)
+        # back off while the child keeps dying; a minute of uptime resets it
+        if time.monotonic() - t0 > 60:
+            delay = 1
+        else:
+            delay = min(delay * 2, 60)
+        time.sleep(delay)
 
 def run_once():
     conf = load_conf()
@@ -207,17 +611,20 @@ def run_once():
             except:
                 pass
 
+@functools.lru_cache(maxsize=1)
 def is_systemd_available():
-    return shutil.which("systemctl") is not None and Path("/run/systemd/system").exists()
+    return _HAS_SYSTEMCTL and Path("/run/systemd/system").exists()
 
 def start():
     print("▶ Starting Pingtunnel...")
     if is_systemd_available():
+        sync_systemd()
         subprocess.run(["systemctl","start",UNIT])
         log("systemctl start requested")
         return
-    # start background monitor
-    cmd = [sys.executable, str(Path(__file__)), "--run"]
+    # start background monitor (precompiled by the installer when available)
+    script = RUNNER_PYC if RUNNER_PYC.exists() else Path(__file__)
+    cmd = [sys.executable, str(script), "--run"]
     with open(LOG_FILE, "a") as out:
         p = subprocess.Popen(cmd, stdout=out, stderr=out, preexec_fn=os.setsid)
     try:
@@ -226,6 +633,29 @@ def start():
         pass
     log("background monitor started pid=%d" % p.pid)
 
+def _proc_pids():
+    # in-process pgrep for the pingtunnel binary (argv[0]) and the Python
+    # monitor (interpreter, run_pingtunnel.py/.pyc or the pingtunnel
+    # symlink, --run). monitors come first so stop() takes them down before
+    # they respawn the binary; shells or sudo merely mentioning
+    # "pingtunnel" elsewhere on their command line are left alone
+    me = os.getpid()
+    monitors, bins = [], []
+    for d in os.listdir("/proc"):
+        if not d.isdigit() or int(d) == me:
+            continue
+        try:
+            with open("/proc/" + d + "/cmdline", "rb") as f:
+                argv = f.read().split(b"\0")
+        except OSError:
+            continue
+        entry = (int(d), b" ".join(argv).decode(errors="replace").strip())
+        if os.path.basename(argv[0]).startswith(b"pingtunnel"):
+            bins.append(entry)
+        elif len(argv) > 2 and b"pingtunnel" in os.path.basename(argv[1]) and b"--run" in argv[2:]:
+            monitors.append(entry)
+    return monitors + bins
+
 def stop():
     print("⛔ Stopping Pingtunnel...")
     if is_systemd_available():
@@ -235,30 +665,67 @@ def stop():
     if PID_FILE.exists():
         try:
             pid = int(PID_FILE.read_text().strip())
-            os.kill(pid, signal.SIGTERM)
-            time.sleep(1)
+            # start() ran the monitor under setsid, so its pid is also the
+            # process group of the monitor and the pingtunnel child; both
+            # are signalled. the monitor isn't our child, so no waitpid();
+            # a pidfd (Linux 5.3+) turns readable exactly when it exits and
+            # isn't fooled by pid reuse, otherwise poll. up to 5s before SIGKILL
             try:
-                os.kill(pid, 0)
-                os.kill(pid, signal.SIGKILL)
-            except:
-                pass
-            PID_FILE.unlink()
+                pidfd = os.pidfd_open(pid)
+            except (AttributeError, OSError):
+                pidfd = None
+            try:
+                os.killpg(pid, signal.SIGTERM)
+                if pidfd is not None:
+                    gone = bool(select.select([pidfd], [], [], 5.0)[0])
+                else:
+                    gone = False
+                    for _ in range(100):
+                        time.sleep(0.05)
+                        try:
+                            os.kill(pid, 0)
+                        except ProcessLookupError:
+                            gone = True
+                            break
+                if not gone:
+                    try:
+                        os.killpg(pid, signal.SIGKILL)
+                    except:
+                        pass
+            finally:
+                if pidfd is not None:
+                    os.close(pidfd)
+            PID_FILE.unlink(missing_ok=True)
             log("background monitor stopped")
         except Exception as e:
             log("stop error: " + str(e))
     else:
-        subprocess.run(["pkill","-f","pingtunnel"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for pid, _ in _proc_pids():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
         log("pkill fallback used")
 
 def restart(): 
     print("🔄 Restarting the Tunnel")
-    subprocess.run(["systemctl","restart",UNIT])
+    if is_systemd_available():
+        sync_systemd()
+        subprocess.run(["systemctl","restart",UNIT])
+    else:
+        stop()
+        start()
     print("▶ Tunnel has been restarted.")
     
-def status():
+def status(verbose=False):
     print("📡 Checking Pingtunnel status...")
     if is_systemd_available():
-        subprocess.run(["systemctl","status",UNIT,"--no-pager"])
+        if verbose:
+            subprocess.run(["systemctl","status",UNIT,"--no-pager"])
+        else:
+            # exit code only; no journal lookup or output to format
+            rc = subprocess.run(["systemctl","is-active","--quiet",UNIT]).returncode
+            print(UNIT, "active" if rc == 0 else "inactive")
         return
     if PID_FILE.exists():
         try:
@@ -268,12 +735,26 @@ def status():
             return
         except:
             print("stale pidfile")
-    subprocess.run(["pgrep","-fl","pingtunnel"])
+    for pid, cmd in _proc_pids():
+        print(pid, cmd)
+
+def tail_lines(path, n, blocksize=8192):
+    # read backwards from EOF until n+1 newlines are in hand
+    with open(path, "rb") as f:
+        pos = f.seek(0, 2)
+        data = b""
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(blocksize, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    return data.splitlines()[-n:] if n > 0 else []
 
 def logs(n=200):
-    print("🧾 Showing last {lines} log lines...")
+    print(f"🧾 Showing last {n} log lines...")
     if LOG_FILE.exists():
-        subprocess.run(["tail","-n", str(n), str(LOG_FILE)])
+        for line in tail_lines(LOG_FILE, n):
+            print(line.decode("utf-8", "replace"))
     else:
         print("no logs yet at", LOG_FILE)
 
@@ -288,57 +769,53 @@ def update():
 def uninstall():
     print("💣 Uninstalling Pingtunnel...")
     stop()
-    os.system("systemctl disable pingtunnel.service")
-    os.system("rm -rf /var/log/pingtunnel")
-    os.system("rm -rf /opt/pingtunnel")
-    os.system("rm -rf /usr/local/bin/pingtunnel")
+    # drop-in and unit removal share one daemon-reload at the end
+    reload = False
     if is_systemd_available():
         subprocess.run(["systemctl","disable",UNIT], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        try:
-            dr = Path("/etc/systemd/system") / (UNIT + ".d")
-            if dr.exists():
-                for f in dr.iterdir():
-                    f.unlink()
-                dr.rmdir()
-        except:
-            pass
+        dropin = Path("/etc/systemd/system") / (UNIT + ".d")
+        if dropin.exists():
+            shutil.rmtree(dropin, ignore_errors=True)
+            reload = True
     try:
-        if Path("__INSTALL_DIR__").exists():
-            shutil.rmtree(Path("__INSTALL_DIR__"))
+        shutil.rmtree(Path("$install_dir"))
+    except FileNotFoundError:
+        pass
     except Exception as e:
         log("remove error: " + str(e))
+    shutil.rmtree(Path("$log_dir"), ignore_errors=True)
     try:
-        if Path("__LOG_DIR__").exists():
-            shutil.rmtree(Path("__LOG_DIR__"))
-    except:
+        Path("$unit_path").unlink()
+        reload = True
+    except OSError:
         pass
+    if reload and _needs_reload():
+        subprocess.run(["systemctl","daemon-reload"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     try:
-        u = Path("__UNIT_PATH__")
-        if u.exists():
-            u.unlink()
-            subprocess.run(["systemctl","daemon-reload"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    except:
-        pass
-    try:
-        sl = Path("__SYMLINK__")
-        if sl.exists() or sl.is_symlink():
-            sl.unlink()
-    except:
+        Path("$symlink").unlink(missing_ok=True)
+    except OSError:
         pass
     log("uninstall finished")
 
-def safe_extract(zipfile_path, target_dir):
-    with zipfile.ZipFile(zipfile_path, "r") as z:
-        for name in z.namelist():
-            resolved = (target_dir / name).resolve()
-            if not str(resolved).startswith(str(target_dir.resolve())):
-                raise Exception("unsafe zip")
-        z.extractall(target_dir)
-
 def clear():
     os.system("cls" if os.name == "nt" else "clear")
 
-def show_menu():
+# verb -> action, shared by the command line, the menu and the installer's panel
+ACTIONS = {
+    "start": start,
+    "stop": stop,
+    "restart": restart,
+    "status": status,
+    "logs": logs,
+    "edit": edit,
+    "update": update,
+    "uninstall": uninstall,
+}
+
+_MENU_KEYS = {"1": "start", "2": "stop", "3": "restart", "4": "status",
+              "5": "logs", "6": "edit", "7": "uninstall", "9": "update"}
+
+def show_menu(Fore, Style):
     clear()
     print(Fore.CYAN + "╔════════════════════════════════════════╗")
     print(Fore.CYAN + "║" + Fore.YELLOW + "        🛰️  Pingtunnel Manager           " + Fore.CYAN + "║")
@@ -351,73 +828,74 @@ def show_menu():
     print(Fore.CYAN + "╚════════════════════════════════════════╝")
     print(Style.BRIGHT + Fore.MAGENTA + "Choose an option: ", end="")
 
+def menu():
+    # colorama is only needed here, so the CLI verbs and the installer,
+    # which imports this module for write_env, neither load it nor get
+    # their stdout wrapped
+    from colorama import Fore, Style, init
+    init(autoreset=True)
+    while True:
+        show_menu(Fore, Style)
+        c = input().strip()
+        if c == "8":
+            print(Fore.MAGENTA + "👋 Goodbye!")
+            break
+        action = ACTIONS.get(_MENU_KEYS.get(c))
+        if action:
+            action()
+        else:
+            print(Fore.RED + "Invalid choice, please try again.")
+        input(Fore.CYAN + "\nPress Enter to return to menu...")
+
 # ========== Main entry ==========
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         cmd = sys.argv[1].lower()
-        if cmd == "--run":
-            monitor_loop()
-        elif cmd == "start":
-            start()
-        elif cmd == "stop":
-            stop()
-        elif cmd == "restart":
-            restart()
-        elif cmd == "status":
-            status()
-        elif cmd == "logs":
-            logs(int(sys.argv[2]) if len(sys.argv) > 2 else 200)
-        elif cmd == "edit":
-            edit()
-        elif cmd == "update":
-            update()
-        elif cmd in ["--uninstall", "uninstall"]:
-            uninstall()
+        action = {
+            **ACTIONS,
+            "--run": monitor_loop,
+            "status": lambda: status("-v" in sys.argv[2:]),
+            "logs": lambda: logs(int(sys.argv[2]) if len(sys.argv) > 2 else 200),
+            "apply-mem": lambda: apply_systemd_mem(load_conf()),
+            "--uninstall": uninstall,
+        }.get(cmd)
+        if action:
+            action()
         else:
-            print(Fore.YELLOW + "Usage: " + Fore.WHITE + "pingtunnel.py [--run|start|stop|restart|status|logs|edit|update|uninstall]")
+            print("Usage: pingtunnel.py [--run|start|stop|restart|status|logs|edit|update|apply-mem|uninstall]")
     else:
-        while True:
-            show_menu()
-            c = input().strip()
-            if c == "1": start()
-            elif c == "2": stop()
-            elif c == "3": restart()
-            elif c == "4": status()
-            elif c == "5": logs()
-            elif c == "6": edit()
-            elif c == "7": uninstall()
-            elif c == "8":
-                print(Fore.MAGENTA + "👋 Goodbye!")
-                break
-            elif c == "9": update()
-            else:
-                print(Fore.RED + "Invalid choice, please try again.")
-            input(Fore.CYAN + "\nPress Enter to return to menu...")
+        menu()
 '''
 
+def _runner_content():
+    # rendered on demand; only install needs it
+    return string.Template(RUNNER_TEMPLATE).substitute(
+        install_dir=str(INSTALL_DIR),
+        log_dir=str(LOG_DIR),
+        unit=SYSTEMD_UNIT,
+        urls_json=json.dumps(URLS),
+        unit_path=str(UNIT_PATH),
+        symlink=str(SYMLINK),
+    )
+
 def write_runner():
-    s = RUNNER_TEMPLATE.replace("__INSTALL_DIR__", str(INSTALL_DIR))
-    s = s.replace("__LOG_DIR__", str(LOG_DIR))
-    s = s.replace("__UNIT__", SYSTEMD_UNIT)
-    s = s.replace("__URLS_JSON__", json.dumps(URLS))
-    s = s.replace("__UNIT_PATH__", str(UNIT_PATH))
-    s = s.replace("__SYMLINK__", str(SYMLINK))
-    s = s.replace("__LOG_DIR__", str(LOG_DIR))
-    s = s.replace("__INSTALL_DIR__", str(INSTALL_DIR))
-    open(RUNNER_PATH, "w").write(s)
-    try:
-        RUNNER_PATH.chmod(0o700)
-    except:
-        pass
+    _atomic_write(RUNNER_PATH, _runner_content(), 0o700)
+    # the unit runs the bytecode so each service (re)start skips the compile
+    py_compile.compile(str(RUNNER_PATH), cfile=str(RUNNER_PYC), doraise=True)
+    # a runner module loaded earlier in this process is now stale
+    _load_runner.cache_clear()
 
-def write_systemd_unit():
+def write_systemd_unit(binp):
+    # systemd supervises the binary directly (Restart=, MemoryMax=, logging);
+    # the Python monitor loop is only used on hosts without systemd
     content = f"""[Unit]
-Description=pingtunnel runner
+Description=pingtunnel
 After=network.target
 
 [Service]
 Type=simple
-ExecStart={sys.executable} {RUNNER_PATH} --run
+EnvironmentFile={ENV_PATH}
+ExecStart={binp} -key ${{KEY}} $ARGS
 Restart=on-failure
 RestartSec=5
 WorkingDirectory={INSTALL_DIR}
@@ -427,17 +905,54 @@ StandardError=append:{LOG_DIR}/pingtunnel.log
 [Install]
 WantedBy=multi-user.target
 """
-    UNIT_PATH.write_text(content)
-    subprocess.run(["systemctl", "daemon-reload"], check=False)
+    if _write_if_changed(UNIT_PATH, content):
+        schedule_reload()
 
 def create_symlink_to_runner():
+    # build the link under a temp name and rename it into place, so the
+    # command never disappears while an old link is being replaced
+    tmp = SYMLINK.with_name(SYMLINK.name + ".tmp")
     try:
-        if SYMLINK.exists() or SYMLINK.is_symlink():
-            SYMLINK.unlink()
-        SYMLINK.symlink_to(RUNNER_PATH)
+        tmp.unlink(missing_ok=True)
+        tmp.symlink_to(RUNNER_PATH)
+        os.replace(tmp, SYMLINK)
     except Exception as e:
         print("symlink error:", e)
 
+def _default_cfg():
+    return {"type": "server", "key": "123456", "tcp": 1, "memory_mb": 500, "autostart": False}
+
+def _merge_cfg(overrides):
+    cfg = _default_cfg()
+    cfg.update(overrides)
+    # same spelling rule as the runner, which lowercases the type
+    cfg["type"] = str(cfg["type"]).lower()
+    if cfg["type"] not in ("server","client"):
+        cfg["type"] = "server"
+    if cfg["type"] == "client":
+        cfg.setdefault("l_port", 4000)
+        cfg.setdefault("server", "127.0.0.1")
+    cfg["installed_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    return cfg
+
+def load_batch_config(config_file=None):
+    # unattended installs: --config <file> or a JSON blob in $PINGTUNNEL_CONFIG
+    if config_file:
+        batch, src = json.loads(Path(config_file).read_text()), config_file
+    else:
+        raw = os.environ.get("PINGTUNNEL_CONFIG")
+        if not raw:
+            return None
+        batch, src = json.loads(raw), "PINGTUNNEL_CONFIG"
+    if not isinstance(batch, dict):
+        die("%s must hold a JSON object, not %s" % (src, type(batch).__name__))
+    return batch
+
+def write_config(cfg):
+    _atomic_write(CONFIG_PATH, json.dumps(cfg, indent=2))
+    print("Saved config to", CONFIG_PATH)
+    return cfg
+
 def interactive_config():
     cfg = {}
     t = input("Type (server/client) [server]: ").strip().lower() or "server"
@@ -465,64 +980,93 @@ def interactive_config():
     aut = input("Are you sure to setup this in not Reinstall? (y/N) : ").strip().lower()
     cfg["autostart"] = aut == "y"
     cfg["installed_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
-    CONFIG_PATH.write_text(json.dumps(cfg, indent=2))
-    print("Saved config to", CONFIG_PATH)
+    return write_config(cfg)
 
 def apply_memory_dropin(mem_mb):
     dropin_dir = Path("/etc/systemd/system") / (SYSTEMD_UNIT + ".d")
     if mem_mb and mem_mb > 0:
         dropin_dir.mkdir(parents=True, exist_ok=True)
-        (dropin_dir / "memory.conf").write_text("[Service]\nMemoryLimit=%dM\n" % mem_mb)
-        subprocess.run(["systemctl","daemon-reload"], check=False)
+        if _write_if_changed(dropin_dir / "memory.conf", "[Service]\nMemoryMax=%dM\nMemoryHigh=%dM\n" % (mem_mb, int(mem_mb * 0.9))):
+            schedule_reload()
     else:
         try:
-            f = dropin_dir / "memory.conf"
-            if f.exists():
-                f.unlink()
-                subprocess.run(["systemctl","daemon-reload"], check=False)
-        except:
+            (dropin_dir / "memory.conf").unlink()
+            schedule_reload()
+        except OSError:
             pass
 
-def install_flow():
+def install_flow(config_file=None):
     if not is_root():
         die("run installer as root")
     ensure_dirs()
+    batch = load_batch_config(config_file)
     url = detect_download_url()
     if not url:
         die("unsupported arch")
-    tmp = tempfile.mktemp(suffix=".zip")
+    installed = _installed_release(url)
+    etag = installed.get("etag") if installed else None
     print("Downloading pingtunnel:", url)
-    download_file(url, tmp)
-    print("Extracting...")
-    safe_extract(tmp, BIN_DIR)
-    try:
-        os.remove(tmp)
-    except:
-        pass
-    binp = find_pingtunnel_binary()
+    # the runner, config and symlink don't need the zip, so write
+    # them while the download is still in flight
+    cfg = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+        download = pool.submit(download_file, url, etag=etag)
+        write_runner()
+        if batch is not None:
+            cfg = write_config(_merge_cfg(batch))
+        elif not CONFIG_PATH.exists():
+            if sys.stdin.isatty():
+                cfg = interactive_config()
+            else:
+                cfg = write_config(_merge_cfg({}))
+        else:
+            print("Config already exists at", CONFIG_PATH)
+        create_symlink_to_runner()
+        buf, new_etag = download.result()
+    if buf is None:
+        print("pingtunnel binary is already up to date")
+        # a 304 only happens with an etag, i.e. a verified installed binary
+        binp = Path(installed["binary"])
+    else:
+        print("Extracting...")
+        with buf:
+            binp = safe_extract(buf, BIN_DIR) or find_pingtunnel_binary()
+        if binp and new_etag:
+            _atomic_write(STATE_PATH, json.dumps({"url": url, "etag": new_etag, "sha256": _sha256(binp), "binary": str(binp)}))
     if not binp:
         die("could not find pingtunnel binary after extract")
     try:
         binp.chmod(0o755)
     except:
         pass
-    write_runner()
-    if not CONFIG_PATH.exists():
-        interactive_config()
-    else:
-        print("Config already exists at", CONFIG_PATH)
-    create_symlink_to_runner()
-    write_systemd_unit()
+    write_systemd_unit(binp)
+    # only an existing config still has to be read back; the unit can't
+    # start without an env file rendered from it, so a broken one is fatal
+    if cfg is None:
+        try:
+            cfg = json.loads(CONFIG_PATH.read_text())
+        except (OSError, ValueError) as e:
+            die("cannot read %s: %s" % (CONFIG_PATH, e))
+    # record the binary so the runner's find_bin skips the bin/ walk
+    if cfg.get("binary") != str(binp):
+        cfg["binary"] = str(binp)
+        write_config(cfg)
+    # the env file comes from the runner's own build_args/write_env, so
+    # install and start/restart can't render different flags
+    r = _load_runner()
+    r.write_env(r.load_conf())
+    # the memory limit is optional; a bad value or write is reported, not fatal
     try:
-        cfg = json.loads(CONFIG_PATH.read_text())
-        apply_memory_dropin(cfg.get("memory_mb", 0))
-    except:
-        pass
+        apply_memory_dropin(int(cfg.get("memory_mb", 0) or 0))
+    except (OSError, ValueError) as e:
+        print("memory limit not applied:", e)
+    flush_reload()
     if cfg.get("autostart"):
-        if shutil.which("systemctl"):
-            subprocess.run(["systemctl", "enable", SYSTEMD_UNIT], check=False)
-            subprocess.run(["systemctl", "start", SYSTEMD_UNIT], check=False)
-            print("Service enabled and started via systemd")
+        if _HAS_SYSTEMCTL:
+            if run(["systemctl", "enable", "--now", SYSTEMD_UNIT]).returncode == 0:
+                print("Service enabled and started via systemd")
+            else:
+                print("systemctl enable --now failed; check 'pingtunnel status'")
         else:
             print("systemd not found; autostart skipped")
     else:
@@ -532,49 +1076,23 @@ def uninstall_flow():
     if not is_root():
         die("run as root")
     # try to stop
-    if shutil.which("systemctl"):
-        subprocess.run(["systemctl","stop", SYSTEMD_UNIT], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        subprocess.run(["systemctl","disable", SYSTEMD_UNIT], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    try:
-        dr = Path("/etc/systemd/system") / (SYSTEMD_UNIT + ".d")
-        if dr.exists():
-            for f in dr.iterdir():
-                f.unlink()
-            dr.rmdir()
-            subprocess.run(["systemctl","daemon-reload"], check=False)
-    except:
-        pass
-    try:
-        if UNIT_PATH.exists():
-            UNIT_PATH.unlink()
-            subprocess.run(["systemctl","daemon-reload"], check=False)
-    except:
-        pass
-    try:
-        if SYMLINK.exists() or SYMLINK.is_symlink():
-            SYMLINK.unlink()
-    except:
-        pass
-    try:
-        if RUNNER_PATH.exists():
-            RUNNER_PATH.unlink()
-    except:
-        pass
-    try:
-        if INSTALL_DIR.exists():
-            shutil.rmtree(INSTALL_DIR)
-    except:
-        pass
-    try:
-        if LOG_DIR.exists():
-            shutil.rmtree(LOG_DIR)
-    except:
-        pass
-    try:
-        if PID_FILE.exists():
-            PID_FILE.unlink()
-    except:
-        pass
+    if _HAS_SYSTEMCTL:
+        run(["systemctl","stop", SYSTEMD_UNIT])
+        run(["systemctl","disable", SYSTEMD_UNIT])
+    dr = Path("/etc/systemd/system") / (SYSTEMD_UNIT + ".d")
+    if dr.exists():
+        shutil.rmtree(dr, ignore_errors=True)
+        schedule_reload()
+    for target in (UNIT_PATH, SYMLINK, RUNNER_PATH, PID_FILE):
+        try:
+            target.unlink()
+            if target == UNIT_PATH:
+                schedule_reload()
+        except OSError:
+            pass
+    for target in (INSTALL_DIR, LOG_DIR):
+        shutil.rmtree(target, ignore_errors=True)
+    flush_reload()
     print("Uninstalled")
 
 def menu_install_prompt():
@@ -584,76 +1102,43 @@ def menu_install_prompt():
     install_flow()
     print("Done.")
 
+@functools.lru_cache(maxsize=1)
+def _load_runner():
+    # the panel (and install_flow's env file) call the runner's functions
+    # in-process instead of spawning a fresh interpreter for every action;
+    # write_runner() drops this cache whenever it rewrites the runner
+    import importlib.util
+    spec = importlib.util.spec_from_file_location("run_pingtunnel", RUNNER_PATH)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
 def main_menu():
+    # the panel is the runner's own menu, run in-process; only installing
+    # has to happen here when there is no runner yet
     if not is_root():
         die("run as root")
-    while True:
-        print("""
-Pingtunnel setup panel (CLI)
-1) Install / Setup (asks config & installs)
-2) Edit config
-3) Start
-4) Stop
-5) Restart
-6) Status
-7) Logs
-8) Uninstall
-9) Exit
-""")
-        c = input("choice: ").strip()
-        if c == "1":
-            install_flow()
-        elif c == "2":
-            if CONFIG_PATH.exists():
-                subprocess.run([str(RUNNER_PATH), "edit"])
-            else:
-                print("no config, run install first")
-        elif c == "3":
-            if RUNNER_PATH.exists():
-                subprocess.run([str(RUNNER_PATH), "start"])
-            else:
-                print("not installed")
-        elif c == "4":
-            if RUNNER_PATH.exists():
-                subprocess.run([str(RUNNER_PATH), "stop"])
-            else:
-                print("not installed")
-        elif c == "5":
-            if RUNNER_PATH.exists():
-                subprocess.run([str(RUNNER_PATH), "restart"])
-            else:
-                print("not installed")
-        elif c == "6":
-            if RUNNER_PATH.exists():
-                subprocess.run([str(RUNNER_PATH), "status"])
-            else:
-                print("not installed")
-        elif c == "7":
-            if RUNNER_PATH.exists():
-                subprocess.run([str(RUNNER_PATH), "logs", "200"])
-            else:
-                print("not installed")
-        elif c == "8":
-            yn = input("Are you sure? This will remove everything (yes/no): ").strip().lower()
-            if yn == "yes":
-                uninstall_flow()
-                break
-        elif c == "9":
-            break
-        else:
-            print("invalid")
+    if not RUNNER_PATH.exists():
+        install_flow()
+    _load_runner().menu()
 
 # Entry
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         a = sys.argv[1].lower()
-        if a in ("install","setup"):
-            install_flow()
-        elif a == "uninstall":
-            uninstall_flow()
-        elif a in ("start","stop","restart","status","logs","edit","update"):
+        cf = sys.argv[sys.argv.index("--config") + 1] if "--config" in sys.argv[2:-1] else None
+        action = {
+            "install": lambda: install_flow(cf),
+            "setup": lambda: install_flow(cf),
+            "uninstall": uninstall_flow,
+            "menu": main_menu,
+        }.get(a)
+        if action:
+            action()
+        elif a in ("start","stop","restart","status","logs","edit","update","apply-mem"):
             if RUNNER_PATH.exists():
-                subprocess.run([str(RUNNER_PATH), a] + sys.argv[2:])
+                # hand the process over; nothing is left to do here afterwards
+                os.execv(str(RUNNER_PATH), [str(RUNNER_PATH), a] + sys.argv[2:])
             else:
                 print("runner not found; install first")
         else: